@@ -1,41 +1,57 @@
 import os
+import multiprocessing as mp
 from schrodinger.structure import StructureReader, StructureWriter
 from schrodinger.application.jaguar.utils import mmjag_update_lewis
 from schrodinger.structutils.analyze import evaluate_asl
 import string
 
 def generate_molres(length):
-    molres = []
     alphabet = string.ascii_uppercase
-    num_alphabet = len(alphabet)
-    
-    for i in range(length):
-        if i < num_alphabet:
-            letter = alphabet[i]
-            molres.append(letter * 3)
-        else:
-            number = i - num_alphabet + 1
-            molres.append(str(number) * 3)
-    
-    return molres
+    return tuple(c * 3 for c in alphabet[:min(length, len(alphabet))]) + \
+        tuple(str(i + 1) * 3 for i in range(length - len(alphabet)))
+
+# Prepared structures keyed on (species, charge); mmjag_update_lewis is
+# by far the most expensive call here and the same monomer recurs across
+# systems in a batch run, so only run it once per unique species
+_prepared_cache = {}
+
+def prepare_species(args):
+    """
+    Read and Lewis-update the monomer structure for a single species.
+
+    Residue metadata is applied by the caller since it depends on where
+    the species sits in a particular system, so each species only needs
+    to be prepared once per run.
+    """
+    sp, charge = args
+    fname = sp+'.pdb'
+    if sp in {'C9H18NO', 'AsF6-', 'OV+2', 'O2V+'}:
+        # Special treatment:
+        # TEMPO: Desmond does not like radicals
+        # As-F, OV+2, O2V+: No parameters
+        fname = sp + '.mae'
+    print(fname)
+    st = StructureReader.read(os.path.join('ff', fname))
+    if fname.endswith('.pdb'):
+        st.property['i_m_Molecular_charge'] = charge
+        mmjag_update_lewis(st)
+    return st
 
 def write_monomers(cat, an, solv, charges, directory):
-    st_list = []
     species = cat+an+solv
     molres = generate_molres(len(cat+an+solv))
     chainIDs = len(cat + an)*['A']+len(solv)*['B']
+    # Prepare any species we have not seen yet, in parallel
+    misses = list(dict.fromkeys(key for key in zip(species, charges)
+                                if key not in _prepared_cache))
+    if misses:
+        pool = mp.Pool(min(len(misses), mp.cpu_count()))
+        for key, st in zip(misses, pool.map(prepare_species, misses)):
+            _prepared_cache[key] = st
+        pool.close()
+    st_list = []
     for sp, charge, res_name, chain_name in zip(species, charges, molres, chainIDs):
-        fname = sp+'.pdb'
-        if sp in {'C9H18NO', 'AsF6-', 'OV+2', 'O2V+'}:
-            # Special treatment:
-            # TEMPO: Desmond does not like radicals
-            # As-F, OV+2, O2V+: No parameters
-            fname = sp + '.mae'
-        print(fname)
-        st = StructureReader.read(os.path.join('ff', fname))
-        if fname.endswith('.pdb'):
-            st.property['i_m_Molecular_charge'] = charge
-            mmjag_update_lewis(st)
+        st = _prepared_cache[(sp, charge)].copy()
         # Iterate over residues
         for res in st.residue:
             res.chain = chain_name
@@ -52,12 +68,17 @@ def zob_metals(st):
     This only applies to VO2^+ and VO^2+
     """
     metals = evaluate_asl(st, "metals")
-    if metals:
-        assert len(metals) == 1
-        charge = st.formal_charge
-        for at in st.atom:
-            at.formal_charge = 0
-        for at_idx in metals:
-            for bond in st.atom[at_idx].bond:
-                bond.order = 0
-            st.atom[at_idx].formal_charge = charge
+    if not metals:
+        return
+    assert len(metals) == 1
+    # Capture the total charge before the per-atom zeroing mutates it,
+    # and keep st.atom in a local so the loop avoids repeated property
+    # lookups through the structure
+    charge = st.formal_charge
+    atoms = st.atom
+    for at in atoms:
+        at.formal_charge = 0
+    metal = atoms[metals[0]]
+    for bond in metal.bond:
+        bond.order = 0
+    metal.formal_charge = charge
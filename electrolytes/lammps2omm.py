@@ -17,17 +17,19 @@ The script is heavily modified from:
 """
 
 import xml.etree.ElementTree as ET
+import os
 import re
+import functools
 import json
 from json import encoder
 encoder.FLOAT_REPR = lambda o: format(o, '.15f')
 import string
 import MDAnalysis as mda
+from dataclasses import dataclass, field
 from pathlib import Path
 import math
 import numpy as np
 import contextlib
-from itertools import combinations
 import subprocess
 from rdkit.Chem import GetPeriodicTable
 
@@ -59,20 +61,39 @@ def generate_molres(length):
     
     return molres
 
-def find_elem_by_mass(target, tol=0.1):
+@functools.lru_cache(maxsize=None)
+def _periodic_table_arrays():
+    """Contiguous atomic-weight and symbol tables, built once from RDKit"""
     pt = GetPeriodicTable()
-    closest_elem = None
-    closest_diff = float('inf')
-    
-    for num in range(1, 119):  # Iterating over known atomic numbers (1 to 118)
-        symbol = pt.GetElementSymbol(num)
-        
-        mass = pt.GetAtomicWeight(num)
-        diff = abs(mass - target)
-        if diff <= closest_diff and diff <= tol:
-            closest_diff = diff
-            closest_elem = symbol
-    return closest_elem
+    masses = np.array([pt.GetAtomicWeight(num) for num in range(1, 119)])
+    symbols = np.array([pt.GetElementSymbol(num) for num in range(1, 119)])
+    return masses, symbols
+
+@functools.lru_cache(maxsize=None)
+def _fourier_header(nterms):
+    """CustomTorsionForce opening tag and per-torsion parameter lines
+
+        Args:
+            nterms (int): number of Fourier terms in the dihedral
+
+        Built once per distinct term count instead of being re-assembled
+        fragment by fragment for every Fourier dihedral line.
+    """
+    energy = "+".join(f'k{i}*(1+cos(n{i}*theta-d{i}))' for i in range(1, nterms+1))
+    params = "".join(f'''<PerTorsionParameter name="k{i}"/>
+    <PerTorsionParameter name="n{i}"/>
+    <PerTorsionParameter name="d{i}"/>
+    ''' for i in range(1, nterms+1))
+    return f'<CustomTorsionForce energy="{energy}">\n' + params
+
+@functools.lru_cache(maxsize=None)
+def find_elem_by_mass(target, tol=0.1):
+    masses, symbols = _periodic_table_arrays()
+    diffs = np.abs(masses - target)
+    idx = np.argmin(diffs)
+    if diffs[idx] <= tol:
+        return symbols[idx].item()
+    return None
 
 ## Conversion units
 radian2degree = 57.2957795130  # 1 rad  = 57.2957795130 degree
@@ -80,46 +101,73 @@ degree2radian = 0.0174533      # Reciprocal of degree2radian
 kcal2kj       = 4.184          # 1 kcal = 4.184 kj
 ang2nm        = 0.1            # 1 Angstrom = 0.1 nanometers
 
+## Compound conversion factors, folded to a single constant so the
+## per-line coeff handlers do one multiply each
+bondk2omm     = 2*kcal2kj/(ang2nm*ang2nm)  # bond K: kcal/mol/A**2 -> 2*kj/mol/nm**2
+anglek2omm    = 2*kcal2kj                  # angle K: kcal/mol/rad**2 -> 2*kj/mol/rad**2
+oplsk2omm     = kcal2kj/2                  # opls K: kcal/mol -> (1/2)*kj/mol
+
 ## grey colour bash text variable. marks unconverted lines in less pronounced light grey colour.
 CGREY = '\33[90m'
 CYLW = '\33[33m'
 CEND = '\33[0m'
 
-## Data from LAMMPS DATA file
+## Echoing every converted coeff line dominates wall time on large force
+## fields, so the per-line prints are off unless explicitly requested.
+VERBOSE = os.environ.get('LAMMPS2OMM_VERBOSE', '0') == '1'
+
+@dataclass
+class LmpState:
+    """Parsed LAMMPS/PDB data threaded through the conversion routines
+
+    Collects what used to be module-level lists, so repeated calls to
+    prep_openmm_md start from a clean slate and the hot loops resolve
+    attributes on one object instead of module globals.
+    """
 
-lmp_id = [] 
-lmp_type = [] 
-lmp_mass = [] 
+    ## Data from LAMMPS DATA file
+    lmp_id: list = field(default_factory=list)
+    lmp_type: list = field(default_factory=list)
+    lmp_mass: list = field(default_factory=list)
 
-lmp_bondtype = [] 
-lmp_bond_ids = [] 
+    lmp_bondtype: list = field(default_factory=list)
+    lmp_bond_ids: list = field(default_factory=list)
 
-lmp_angletype = [] 
-lmp_angle_ids = []
+    lmp_angletype: list = field(default_factory=list)
+    lmp_angle_ids: list = field(default_factory=list)
 
-lmp_dihedraltype = []
-lmp_dihedral_ids = []
+    lmp_dihedraltype: list = field(default_factory=list)
+    lmp_dihedral_ids: list = field(default_factory=list)
 
-lmp_impropertype = []
-improper_atomids_list = []
+    lmp_impropertype: list = field(default_factory=list)
+    improper_atomids_list: list = field(default_factory=list)
 
-lmp_alltypes = []
-lmp_allids = []
-lmp_allels = []
-lmp_allcharges = []
+    ## Representative atom-id tuple per bonded type, filled by grab_lmpdata_attr
+    bondtype_to_ids: dict = field(default_factory=dict)
+    angletype_to_ids: dict = field(default_factory=dict)
+    dihedraltype_to_ids: dict = field(default_factory=dict)
+    impropertype_to_ids: dict = field(default_factory=dict)
 
-## Force field styles from *.in.init file generated by Moltemplate
-bondstyles = []
-anglestyles = []
-dihedralstyles = []
-improperstyles = []
-pairstyles = []
+    lmp_alltypes: list = field(default_factory=list)
+    lmp_allids: list = field(default_factory=list)
+    lmp_allels: list = field(default_factory=list)
+    lmp_allcharges: list = field(default_factory=list)
 
-## Data from PDB file generated by Packmol
-pdb_ids_mol = []
-pdb_names = []
-pdb_resname_mol = []
-pdb_resnames = []
+    ## Element name per atom type, filled once the Masses section is parsed
+    elname_by_type: tuple = ()
+
+    ## Force field styles from *.in.init file generated by Moltemplate
+    bondstyles: list = field(default_factory=list)
+    anglestyles: list = field(default_factory=list)
+    dihedralstyles: list = field(default_factory=list)
+    improperstyles: list = field(default_factory=list)
+    pairstyles: list = field(default_factory=list)
+
+    ## Data from PDB file generated by Packmol
+    pdb_ids_mol: list = field(default_factory=list)
+    pdb_names: list = field(default_factory=list)
+    pdb_resname_mol: list = field(default_factory=list)
+    pdb_resnames: list = field(default_factory=list)
 
 def prep_openmm_md(filename,cat,an,solv,Nmols,directory):
     # Check filename if it is solvent vs. system.
@@ -134,17 +182,17 @@ def prep_openmm_md(filename,cat,an,solv,Nmols,directory):
             Natoms = len(u.atoms)
             u.add_TopologyAttr('record_types',['HETATM']*Natoms)
 
-            # Open the LAMMPS data file manually and read + store topology info. 
-            grab_lmpdata_attr(lmpdata_file)
+            # Open the LAMMPS data file manually and read + store topology info.
+            state = grab_lmpdata_attr(lmpdata_file)
 
             # Add new topology attributes to remove warnings
             # TO-DO: Find cleaner way to get this exception
-            # In GAFF, element names have additional designation. Clean that to provide the core element name. 
+            # In GAFF, element names have additional designation. Clean that to provide the core element name.
             # Example, oxygen in double bond is 'Os'. Let's turn that into 'O'
-            for i, ell in enumerate(lmp_allels):
+            for i, ell in enumerate(state.lmp_allels):
                 if 'Os' ==  ell:
-                    lmp_allels[i] = 'O'
-            u.add_TopologyAttr('elements',lmp_allels)
+                    state.lmp_allels[i] = 'O'
+            u.add_TopologyAttr('elements',state.lmp_allels)
             
             #For chainIDs, distinguish whether the atom is part of solute (A) or solvent (B)
             #u.add_TopologyAttr('chainIDs',['A']*Natoms)
@@ -154,24 +202,24 @@ def prep_openmm_md(filename,cat,an,solv,Nmols,directory):
             u.add_TopologyAttr('occupancies',[1.0]*Natoms)
 
             # Open the corresponding PDB file (generated by packmol)
-            grab_pdbdata_attr(pdb_file)
-           
+            grab_pdbdata_attr(state, pdb_file)
+
             # ChainIDs should distinguish between solvent and solute
             chainIDs = []
             molres = generate_molres(len(cat+an+solv))#[]
             soltorsolv = len(cat + an)*['solute']+len(solv)*['solvent']
-            chainIDs = ['A' if soltorsolv[molres.index(resname)] == 'solute' else 'B' for resname in pdb_resnames]
+            chainIDs = ['A' if soltorsolv[molres.index(resname)] == 'solute' else 'B' for resname in state.pdb_resnames]
             u.add_TopologyAttr('chainIDs',chainIDs)#['A']*Natoms)
-            u.add_TopologyAttr('names',pdb_names)
-            u.add_TopologyAttr('resnames',pdb_resname_mol)
+            u.add_TopologyAttr('names',state.pdb_names)
+            u.add_TopologyAttr('resnames',state.pdb_resname_mol)
 
             # Write the OpenMM Xml force field file
-            write_forcefield(u,filename)
+            write_forcefield(state,u,filename)
 
             # Write the OpenMM PDB file
-            write_pdbfile(u,filename)
+            write_pdbfile(state,u,filename)
 
-            write_metadata(cat,an,solv,Nmols,filename)
+            write_metadata(state,cat,an,solv,Nmols,filename)
         
             # Next check the settings file and see if LAMMPS hybrid style is even necessary
             # Begin by reading the entire contents of the *in.settings file
@@ -212,177 +260,99 @@ def prep_openmm_md(filename,cat,an,solv,Nmols,directory):
         else:
             print(f"Eiher {lmpdata_file} or {pdb_file} don't exist. Not an error, but check if system is molten salt/ionic liquid")
 
-def write_metadata(cat,an,solv,nmols,filename):
+def write_metadata(state,cat,an,solv,nmols,filename):
     metadata = {}
     metadata["species"] = cat+an+solv
     molres = []
     for i, letter in enumerate(string.ascii_uppercase[:len(cat+an+solv)]):
         molres.append(letter*3)
     metadata["residue"] = molres
-    metadata["solute_or_solvent"] = len(cat + an)*['solute']+len(solv)*['solvent'] 
-    metadata["partial_charges"] = lmp_allcharges
+    metadata["solute_or_solvent"] = len(cat + an)*['solute']+len(solv)*['solvent']
+    metadata["partial_charges"] = state.lmp_allcharges
     metadata["composition"] = nmols
     with open(f"metadata_{filename}.json","w") as f:
         j = json.dumps(metadata,indent=4)
         f.write(j)
-def _get_types(line):
-    """ Obtain atom ids, mass, and types from LAMMPS DATA file
-        
-        Args:
-            line (string): A string obtained from a line in LAMMPS DATA file
-    """
-    
-    global lmp_id
-    global lmp_mass
-    global lmp_type
-
-    line = line.split()
-    lmp_id.append(int(line[0]))
-    lmp_mass.append(float(line[1]))
-    lmp_type.append(line[3].lower())
-
-def _get_atoms(line):
-    """ Obtain per-atom types, ids, element names, and charges from LAMMPS DATA file
-
-        Args:
-            line (string): A string obtained from a line in LAMMPS DATA file
-    """
-    
-    global lmp_alltypes
-    global lmp_allids
-    global lmp_allels
-    global lmp_allcharges
-
-    line = line.split()
-    lmp_alltypes.append(lmp_type[int(line[2])-1])
-    lmp_allids.append(int(line[2]))
-    elname = extract_and_capitalize(lmp_type[int(line[2])-1])
-    lmp_allels.append(elname)
-    lmp_allcharges.append(float(line[3]))
-    
-def _get_bondtypes(line):
-    """ Obtain bond type and ids of connected atoms from LAMMPS data file
-        
-        Args:
-            line (string): A string obtained from a line in LAMMPS DATA file
-    """
-    
-    global lmp_bondtype
-    global lmp_bond_ids
+_ELEM_RE = re.compile(r'([A-Za-z]+)')
 
-    line = line.split()
-    lmp_bondtype.append(int(line[1]))
-    lmp_bond_ids.append((int(line[2]),int(line[3])))
+@functools.lru_cache(maxsize=None)
+def extract_and_capitalize(text):
+    """Helper function to extract the element name from a LAMMPS atom type
 
-def _get_angletypes(line):
-    """ Obtain angle type and ids of connected atoms from LAMMPS data file
-        
         Args:
-            line (string): A string obtained from a line in LAMMPS DATA file
-    """
-    
-    global lmp_angletype
-    global lmp_angle_ids
+            text (string): an atom type name, e.g. 'ow' or 'c3'
 
-    line = line.split()
-    lmp_angletype.append(int(line[1]))
-    lmp_angle_ids.append((int(line[2]),int(line[3]),int(line[4])))
-
-def _get_dihedraltypes(line):
-    """ Obtain dihedral type and ids from LAMMPS data file
-        
-        Args:
-            line (string): A string obtained from a line in LAMMPS DATA file
+        The result only depends on the handful of atom types present, so
+        matches are memoized rather than re-running the regex per atom.
     """
-    
-    global lmp_dihedraltype
-    global lmp_dihedral_ids
+    m = _ELEM_RE.match(text)
+    return m.group(1).capitalize() if m else None
 
-    line = line.split()
-    lmp_dihedraltype.append(int(line[1]))
-    lmp_dihedral_ids.append((int(line[2]),int(line[3]),int(line[4]),int(line[5])))
-
-def _get_impropertypes(line):
-    """ Obtain improper type and ids from LAMMPS data file
-        
-        Args:
-            line (string): A string obtained from a line in LAMMPS DATA file
-    """
-    
-    global lmp_impropertype
-    global lmp_improper_ids
-    
-    line = line.split()
-    lmp_impropertype.append(int(line[1]))
-    improper_atomids_list.append((int(line[2]),int(line[3]),int(line[4]),int(line[5])))
-
-"""Helper function to extract molecule name from the filename""" 
-extract_and_capitalize = lambda text: re.match(r'([A-Za-z]+)', text).group(1).capitalize() if re.match(r'([A-Za-z]+)', text) else None
-
-def write_pdbfile(u,filename):
+def write_pdbfile(state,u,filename):
     """Writes the final PDB file used for initializing OpenMM simulation
 
     Args:
+        state (LmpState): parsed LAMMPS/PDB data
         u (MDAnalysis.Universe): A Universe object loaded from LAMMPS DATA file
-        filename (string): Name of PDB file pre-appended to the formatted name. 
+        filename (string): Name of PDB file pre-appended to the formatted name.
     """
-    
+
     #First, write the PDB file from Universe object
     fname = filename+'_init.pdb'
     ag = u.atoms
     ag.write(fname)
-    
+
     #Make sure to generate CONECT information!
-    pdbconect = ""
-    for i, bond in enumerate(lmp_bond_ids):
-        pdbconect += f"CONECT {bond[0]:>{4}} {bond[1]:>{4}} \n"
+    pdbconect = "".join(f"CONECT {bond[0]:>{4}} {bond[1]:>{4}} \n" for bond in state.lmp_bond_ids)
     pdbconect += "END \n"
 
-    #Load the written PDB file again and delete the 'END' line 
-    with open(fname,'r') as file:
-        lines = file.readlines()
-    if lines:
-        lines.pop()
-    with open(fname, 'w') as file:
-        file.writelines(lines)
-
-    # Now, append the PDB CONECT information
-    with open(fname, 'a') as file:
-        file.write(pdbconect)
-    
+    # Truncate the trailing 'END' line in place and append the CONECT
+    # records, instead of reading and rewriting the whole PDB file
+    with open(fname, 'r+b') as file:
+        file.seek(0, 2)
+        size = file.tell()
+        if size > 0:
+            # Find the start of the last line (ignoring the trailing newline)
+            pos = size - 1
+            while pos > 0:
+                file.seek(pos-1)
+                if file.read(1) == b'\n':
+                    break
+                pos -= 1
+            file.seek(pos)
+            file.truncate()
+        file.write(pdbconect.encode())
+
     # Next, run PDBFixer, so that we have a clean initial configuration file
     subprocess.run(f'pdbfixer {fname}',shell=True)
     subprocess.run(f'mv output.pdb {fname}',shell=True)
 
-def write_forcefield(u,filename):
+def write_forcefield(state,u,filename):
     """Writes the final XML file used for performing an OpenMM simulation
 
     Args:
+        state (LmpState): parsed LAMMPS/PDB data
         u (MDAnalysis.Universe): A Universe object loaded from LAMMPS DATA file
-        filename (string): Name of XML file pre-appended to the formatted name. 
+        filename (string): Name of XML file pre-appended to the formatted name.
     """
-    
-    global bondstyles
-    global anglestyles
-    global dihedralstyles
-    global improperstyles
-    global pairstyles
-    
-    # Read the *.in.init file to check what force field styles are present
+
+    # Read the *.in.init file to check what force field styles are present.
+    # Each style directive appears at most once, so populate the state in
+    # a single pass keyed on the first token.
+    style_keys = {"bond_style": "bondstyles",
+                  "angle_style": "anglestyles",
+                  "dihedral_style": "dihedralstyles",
+                  "improper_style": "improperstyles",
+                  "pair_style": "pairstyles"}
     fname = filename+'.in.init'
     with open(fname,'r') as params:
         for line in params:
-            cleaned_line = line.strip()
-            if len(cleaned_line) >= 1 and cleaned_line.split()[0] == "bond_style":
-                bondstyles = cleaned_line.split()[1:]
-            if len(cleaned_line) >= 1 and cleaned_line.split()[0] == "angle_style":
-                anglestyles = cleaned_line.split()[1:]
-            if len(cleaned_line) >= 1 and cleaned_line.split()[0] == "dihedral_style":
-                dihedralstyles = cleaned_line.split()[1:]
-            if len(cleaned_line) >= 1 and cleaned_line.split()[0] == "improper_style":
-                improperstyles = cleaned_line.split()[1:]
-            if len(cleaned_line) >= 1 and cleaned_line.split()[0] == "pair_style":
-                pairstyles = cleaned_line.split()[1:]
+            toks = line.split()
+            if not toks:
+                continue
+            attr = style_keys.get(toks[0])
+            if attr is not None:
+                setattr(state, attr, toks[1:])
 
     # Read the *.in.settings to load the force field parameters
     bond_out = []
@@ -392,139 +362,136 @@ def write_forcefield(u,filename):
     
     # Load the *.in.settings file
     fname = filename+'.in.settings'
+    # Dispatch each coeff line by its first token instead of re-splitting
+    # the line for a chain of startswith-style comparisons
+    coeff_handlers = {"bond_coeff": (_bond, bond_out),
+                      "angle_coeff": (_angle, angle_out),
+                      "dihedral_coeff": (_dihedral, torsion_out),
+                      "improper_coeff": (_improper, torsion_out),
+                      "pair_coeff": (_nonbonding, nonbond_out)}
     with open(fname, 'r') as params:
         # Grab all force field parameters
         for line in params:
             cleaned_line = line.strip()
-            if len(cleaned_line) >= 1 and cleaned_line.split()[0] == "bond_coeff":
-                bond_out.append(_bond(cleaned_line))
-            elif len(cleaned_line) >= 1 and cleaned_line.split()[0] == "angle_coeff":
-                angle_out.append(_angle(cleaned_line))
-            elif len(cleaned_line) >= 1 and cleaned_line.split()[0] == "dihedral_coeff":
-                torsion_out.append(_dihedral(cleaned_line))
-            elif len(cleaned_line) >= 1 and cleaned_line.split()[0] == "improper_coeff":
-                torsion_out.append(_improper(cleaned_line))
-            elif len(cleaned_line) >= 1 and cleaned_line.split()[0] == "pair_coeff":
-                nonbond_out.append(_nonbonding(cleaned_line))
-            print(CGREY+cleaned_line+CEND)
-
-    # Start writing the XML file
+            if cleaned_line:
+                # Tokenize exactly once and hand the fields to the handler
+                tokens = cleaned_line.split()
+                handler = coeff_handlers.get(tokens[0])
+                if handler is not None:
+                    func, out = handler
+                    out.append(func(state, tokens))
+            if VERBOSE:
+                print(CGREY+cleaned_line+CEND)
+
+    # Accumulate the XML in memory and flush it with a single write at
+    # the end instead of issuing many small ff.write calls
+    out = []
+    out.append("<ForceField>\n")
+
+    # Write the Atom Types
+    out.append("<AtomTypes>\n")
+    for i, atomtype in enumerate(state.lmp_type):
+        elname = find_elem_by_mass(state.lmp_mass[i],tol=0.1)
+        out.append(f' <Type name="{atomtype}" class="{elname}" element="{elname}" mass="{state.lmp_mass[i]}"/> \n')
+    out.append("</AtomTypes>\n")
+
+    # Generate the residue template and write the result.
+    residue_template = write_restemplate(state,u)
+    out.append(residue_template)
+
+    #Next, we write the force field parameters
+
+    #(1) Bond Interactions, use harmonic style
+    # see https://docs.lammps.org/bond_harmonic.html for details
+    bond_out = list(filter(lambda x: x is not None, bond_out))
+    harmonic_bonds = list(filter(lambda x: x[0] == 'harmonic', bond_out))
+    out.append('<HarmonicBondForce>\n')
+    for line in harmonic_bonds:
+        out.append(line[1]+"\n")
+    out.append('</HarmonicBondForce>\n')
+
+    #(2) Angle Interactions, use harmonic style
+    # see https://docs.lammps.org/angle_harmonic.html
+    angle_out = list(filter(lambda x: x is not None, angle_out))
+    harmonic_angles = list(filter(lambda x: x[0] == 'harmonic', angle_out))
+    out.append('<HarmonicAngleForce>\n')
+    for line in harmonic_angles:
+        out.append(line[1]+"\n")
+    out.append('</HarmonicAngleForce>\n')
+
+    #(3) Improper Interactions, uses cvff style
+    # see https://docs.lammps.org/improper_cvff.html for details
+    # filter out any Nones
+    torsion_out = list(filter(lambda x: x is not None, torsion_out))
+    impropers = list(filter(lambda x: x[0] == 'improper', torsion_out))
+    cvff_impropers = list(filter(lambda x: x[1] == 'cvff', impropers))
+    out.append('<PeriodicTorsionForce>\n')
+    for line in cvff_impropers:
+        out.append(line[2]+"\n")
+    out.append('</PeriodicTorsionForce>\n')
+
+    #(4) Dihedral Interactions, uses two styles
+    # First style is OPLS as described in https://docs.lammps.org/dihedral_opls.html
+    # Second style is Fourier as desxribed in org/dihedral_fourier.html
+    # Most molecules use the OPLS style, with a few exceptions.
+    dihedrals = list(filter(lambda x: x[0] == 'dihedral', torsion_out))
+    opls_dihedrals = list(filter(lambda x: x[1] == 'opls', dihedrals))
+    if opls_dihedrals:
+        out.append('<PeriodicTorsionForce>\n')
+        for line in opls_dihedrals:
+            out.append(line[2]+"\n")
+        out.append('</PeriodicTorsionForce>\n')
+
+    fourier_dihedrals = list(filter(lambda x: x[1] == 'fourier', dihedrals))
+    if fourier_dihedrals:
+        for line in fourier_dihedrals:
+            number = len(re.findall(r'k\d+="', line[2]))
+            out.append(_fourier_header(number))
+            out.append(line[2]+"\n")
+            out.append('</CustomTorsionForce>\n')
+
+    #(5) NonBonded Interaction, includes Lennard-Jones and Coulomb interaction
+    # The coulomb14scale and lj14scale specifies the 1-4 interaction scale for
+    # Coulombic and Lennard-Jones interactions, respectively.
+    # The choice of 0.5 is derived from OPLS specifications,
+    # see https://zarbi.chem.yale.edu/ligpargen/openMM_tutorial.html for details
+    nonbond_out = list(filter(lambda x: x is not None, nonbond_out))
+    out.append('<NonbondedForce coulomb14scale="0.5" lj14scale="0.5">\n')
+    for line in nonbond_out:
+        out.append(line[0]+"\n")
+    out.append('</NonbondedForce>\n')
+
+    out.append("</ForceField>\n")
+
+    # One write for the whole XML file
     omm_ff = filename+'.xml'
     with open(omm_ff,"w") as ff:
-        ff.write("<ForceField>\n")
-        
-        # Write the Atom Types
-        ff.write("<AtomTypes>\n")
-        for i, atomtype in enumerate(lmp_type):
-            elname = find_elem_by_mass(lmp_mass[i],tol=0.1)
-            ff.write(f' <Type name="{atomtype}" class="{elname}" element="{elname}" mass="{lmp_mass[i]}"/> \n')
-        ff.write("</AtomTypes>\n")
-        
-        # Generate the residue template and write the result. 
-        residue_template = write_restemplate(u)
-        ff.write(residue_template)
-        
-        #Next, we write the force field parameters
-        
-        #(1) Bond Interactions, use harmonic style
-        # see https://docs.lammps.org/bond_harmonic.html for details
-        bond_out = list(filter(lambda x: x is not None, bond_out))
-        harmonic_bonds = list(filter(lambda x: x[0] == 'harmonic', bond_out))
-        ff.write('<HarmonicBondForce>\n')
-        for line in harmonic_bonds:
-            ff.write(line[1]+"\n")
-        ff.write('</HarmonicBondForce>\n')
-        
-        #(2) Angle Interactions, use harmonic style
-        # see https://docs.lammps.org/angle_harmonic.html
-        angle_out = list(filter(lambda x: x is not None, angle_out))
-        harmonic_angles = list(filter(lambda x: x[0] == 'harmonic', angle_out))
-        ff.write('<HarmonicAngleForce>\n')
-        for line in harmonic_angles:
-            ff.write(line[1]+"\n")
-        ff.write('</HarmonicAngleForce>\n')
-        
-        #(3) Improper Interactions, uses cvff style
-        # see https://docs.lammps.org/improper_cvff.html for details
-        # filter out any Nones
-        torsion_out = list(filter(lambda x: x is not None, torsion_out))
-        impropers = list(filter(lambda x: x[0] == 'improper', torsion_out))
-        cvff_impropers = list(filter(lambda x: x[1] == 'cvff', impropers))
-        ff.write('<PeriodicTorsionForce>\n')
-        for line in cvff_impropers:
-            ff.write(line[2]+"\n")
-        ff.write('</PeriodicTorsionForce>\n')
-        
-        #(4) Dihedral Interactions, uses two styles
-        # First style is OPLS as described in https://docs.lammps.org/dihedral_opls.html
-        # Second style is Fourier as desxribed in org/dihedral_fourier.html
-        # Most molecules use the OPLS style, with a few exceptions.
-        dihedrals = list(filter(lambda x: x[0] == 'dihedral', torsion_out))
-        opls_dihedrals = list(filter(lambda x: x[1] == 'opls', dihedrals))
-        if opls_dihedrals:
-            ff.write('<PeriodicTorsionForce>\n')
-            for line in opls_dihedrals:
-                ff.write(line[2]+"\n")
-            ff.write('</PeriodicTorsionForce>\n')
-        
-        fourier_dihedrals = list(filter(lambda x: x[1] == 'fourier', dihedrals))
-        if fourier_dihedrals:
-            for line in fourier_dihedrals:
-                number = len(re.findall(r'k\d+="', line[2]))
-                ff.write('<CustomTorsionForce energy=')
-                if number == 1:
-                            ff.write(f'"k1*(1+cos(n1*theta-d1))')
-                else:
-                    for i in range(1,number+1):
-                        if i < number:
-                            if i == 1:
-                                ff.write(f'"k{i}*(1+cos(n{i}*theta-d{i}))+')
-                            else:
-                                ff.write(f'k{i}*(1+cos(n{i}*theta-d{i}))+')
-                        else:
-                            ff.write(f'k{i}*(1+cos(n{i}*theta-d{i}))')
-                ff.write('">\n')
-                for i in range(1,number+1):
-                    ff.write(f"""<PerTorsionParameter name="k{i}"/>
-    <PerTorsionParameter name="n{i}"/>
-    <PerTorsionParameter name="d{i}"/>
-    """)
-                ff.write(line[2]+"\n")
-                ff.write('</CustomTorsionForce>\n') 
-
-        #(5) NonBonded Interaction, includes Lennard-Jones and Coulomb interaction 
-        # The coulomb14scale and lj14scale specifies the 1-4 interaction scale for 
-        # Coulombic and Lennard-Jones interactions, respectively. 
-        # The choice of 0.5 is derived from OPLS specifications,
-        # see https://zarbi.chem.yale.edu/ligpargen/openMM_tutorial.html for details
-        nonbond_out = list(filter(lambda x: x is not None, nonbond_out))
-        ff.write('<NonbondedForce coulomb14scale="0.5" lj14scale="0.5">\n')
-        for line in nonbond_out:
-            ff.write(line[0]+"\n")
-        ff.write('</NonbondedForce>\n')
-        
-        ff.write("</ForceField>\n")
-    ff.close()
+        ff.write("".join(out))
 
 
-def find_combination(numbers_list, target_tuple):
-    """Helper function to check if a pair of numbers is present in all possible combinations of a list
-    
-        Args: 
-        numbers_list (list): A list of all possbile numbers
-        target_typle (tuple): A tuple of numbers to match with the combinations of numbers_list
-    """
-    num1, num2 = target_tuple
-    return num1 in numbers_list and num2 in numbers_list
-def write_restemplate(u):
+def write_restemplate(state,u):
     """Generates a residue template for the XML force field file
-    
-        Args: 
+
+        Args:
+            state (LmpState): parsed LAMMPS/PDB data
             u (MDAnalysis.Universe): A Universe object loaded from the LAMMPS DATA file
     """
-    
+
+    # Hot loop below runs once per bond; pull the per-atom lists into
+    # locals so each access is a LOAD_FAST instead of an attribute fetch
+    lmp_bond_ids = state.lmp_bond_ids
+    lmp_alltypes = state.lmp_alltypes
+    pdb_names = state.pdb_names
+    pdb_resnames = state.pdb_resnames
+
+    # Materialize the MDAnalysis per-atom attributes once; indexing these
+    # arrays is far cheaper than an Atom attribute fetch per bond
+    a_resname = np.asarray(u.atoms.resnames)
+    a_name = np.asarray(u.atoms.names)
+
     text = "<Residues>\n"
-    resnames = list(set(pdb_resname_mol))
+    resnames = list(set(state.pdb_resname_mol))
+    pdb_ids_set = frozenset(state.pdb_ids_mol)
     for resname in resnames:
         text += f' <Residue name="{resname}">\n'
         bond_text = ""
@@ -533,9 +500,9 @@ def write_restemplate(u):
         
         #Go through and write the bond information
         for i, bond in enumerate(lmp_bond_ids):
-            if u.atoms[bond[0]-1].resname == resname and find_combination(pdb_ids_mol,bond):
-                names.append(u.atoms[bond[0]-1].name)      
-                names.append(u.atoms[bond[1]-1].name)      
+            if a_resname[bond[0]-1] == resname and bond[0] in pdb_ids_set and bond[1] in pdb_ids_set:
+                names.append(a_name[bond[0]-1])
+                names.append(a_name[bond[1]-1])
                 types.append(lmp_alltypes[bond[0]-1])
                 types.append(lmp_alltypes[bond[1]-1])
                 bond_text += f'  <Bond atomName1="{pdb_names[bond[0]-1]}" atomName2="{pdb_names[bond[1]-1]}" /> \n'
@@ -560,9 +527,14 @@ def write_restemplate(u):
         
         #Write the atom names and types associated with the bond information
         if types and names:
-            r, d = zip(*((r, types[i]) for i, r in enumerate(names) if r not in names[:i]))
-            for i in range(len(r)):
-                text += f'  <Atom name="{r[i]}" type="{d[i]}"/> \n'
+            # De-duplicate names in one pass with a seen set, keeping the
+            # first occurrence order
+            seen = set()
+            for i, nm in enumerate(names):
+                if nm in seen:
+                    continue
+                seen.add(nm)
+                text += f'  <Atom name="{nm}" type="{types[i]}"/> \n'
             text += bond_text
         
         #If either no bonds are present, then we have a single atom, i.e., Na+ ion or Cl- ion.
@@ -573,12 +545,13 @@ def write_restemplate(u):
     text += "</Residues>\n"
     return text
 
-def grab_pdbdata_attr(pdb_file):
+def grab_pdbdata_attr(state, pdb_file):
     """Reads the data from PDB file and store them into lists
 
-        Args: 
+        Args:
+            state (LmpState): parsed LAMMPS/PDB data to fill
             pdb_file (string): fname of the PDB file to load
-        
+
         The lists that we modify are:
             - pdb_ids_mol: store 
             - pdb_names: store the chainID from the PDB file, which is alphabetical, e.g., A, B, C, and so on. 
@@ -586,85 +559,142 @@ def grab_pdbdata_attr(pdb_file):
               from the pdb file and give a residue name as a triple of the chain ID. Thus, 
               chainID A -> AAA, B -> BBB, etc.
     """
+    pdb_ids_mol = state.pdb_ids_mol
+    pdb_names = state.pdb_names
+    pdb_resname_mol = state.pdb_resname_mol
+    pdb_resnames = state.pdb_resnames
     with open(pdb_file, 'r') as file:
-        lines = file.readlines()
         chainID = []
         molID = []
         molid = 0
-        
-        for line in lines:
-            lsplit = line.split()
-            if lsplit[0] == 'ATOM' or lsplit[0] == 'HETATM':
-                if lsplit[4] not in chainID:
-                    chainID.append(lsplit[4])
-                    molID.append(lsplit[5])
+
+        # PDB records have a fixed 80-column layout; slice the fields by
+        # byte range instead of whitespace-splitting, which also stays
+        # correct when the chain ID runs into a 4-digit residue number
+        for line in file:
+            rec = line[0:6].strip()
+            if rec == 'ATOM' or rec == 'HETATM':
+                serial = int(line[6:11])
+                name = line[12:16].strip()
+                chain = line[21:22]
+                resseq = int(line[22:26])
+                if chain not in chainID:
+                    chainID.append(chain)
+                    molID.append(resseq)
                     molid = 0
-                if molID[-1] == lsplit[5]:
-                    pdb_ids_mol.append(int(lsplit[1]))
-                pdb_names.append(str(lsplit[2]))
-                if len(lsplit[4]) == 1:
-                    pdb_resnames.append(str(lsplit[4]*3))
-                else:
-                    pdb_resnames.append(str(lsplit[4][0]*3))
-                try:
-                    if np.abs(molid-int(lsplit[5])) > 0:
-                        pdb_resname_mol.append(str(lsplit[4]*3))
-                        molid = int(lsplit[5])
-                except Exception as e:
-                    if np.abs(molid-int(lsplit[4][1:])) > 0:
-                        pdb_resname_mol.append(str(lsplit[4][0]*3))
-                        molid = int(lsplit[4][1:])
+                if molID[-1] == resseq:
+                    pdb_ids_mol.append(serial)
+                pdb_names.append(name)
+                pdb_resnames.append(chain*3)
+                if molid != resseq:
+                    pdb_resname_mol.append(chain*3)
+                    molid = resseq
+
+def _section_rows(lines, start, ntokens):
+    """Collect the data rows of a LAMMPS DATA section in one slice
+
+        Args:
+            lines (list): all lines of the DATA file
+            start (int): index of the line holding the section header
+            ntokens (int): number of whitespace-separated tokens in a data row
+    """
+    rows = []
+    for line in lines[start+1:]:
+        cleaned_line = line.strip()
+        if not cleaned_line:
+            if rows:
+                break
+            continue
+        if len(cleaned_line.split()) != ntokens:
+            break
+        rows.append(cleaned_line)
+    return rows
 
 def grab_lmpdata_attr(dname):
-    """Reads the data from LAMMPS data file and store them into lists
+    """Reads the data from LAMMPS data file into a fresh LmpState
 
-        Args: 
+        Args:
             dname (string): fname of the LAMMPS DATA file to load
-        
-        The lists that we modify are:
-            - lmp_id
-            - lmp_mass
-            - lmp_type
-            - 
+
+        Returns:
+            LmpState: parsed atom, topology, and charge data
+
+        The file is parsed section by section: one pass locates the
+        "Masses"/"Atoms"/... headers, then each section is converted as a
+        typed block with np.loadtxt instead of line by line.
     """
-    global lmp_id
-    global lmp_mass
-    global lmp_type
+    state = LmpState()
 
     namelist = ["Masses","Atoms","Bonds","Angles","Dihedrals","Impropers"]
-    checks = [False]*len(namelist)
     with open(dname,"r") as params:
-        for line in params:
-            cleaned_line = line.strip()
-            for name in namelist:
-                if name in cleaned_line:
-                    checks = [False]*len(namelist)
-                    idx = namelist.index(name)
-                    checks[idx] = True
-            if checks[0] and len(cleaned_line.split()) == 4:
-                _get_types(cleaned_line)
-                sorted_indices = [index for index, _ in sorted(enumerate(lmp_id), key=lambda x: x[1])]
-                lmp_id = np.array(lmp_id)[sorted_indices].tolist()
-                lmp_mass = np.array(lmp_mass)[sorted_indices].tolist()
-                lmp_type = np.array(lmp_type)[sorted_indices].tolist()
-            if checks[1] and len(cleaned_line.split()) == 7:
-                _get_atoms(cleaned_line)
-            if checks[2] and len(cleaned_line.split()) == 4:
-                _get_bondtypes(cleaned_line)
-            if checks[3] and len(cleaned_line.split()) == 5:
-                _get_angletypes(cleaned_line)
-            if checks[4] and len(cleaned_line.split()) == 6:
-                _get_dihedraltypes(cleaned_line)
-            if checks[5] and len(cleaned_line.split()) == 6:
-                _get_impropertypes(cleaned_line)
+        lines = params.readlines()
+
+    # One pass to locate the start of every section
+    offsets = {}
+    for i, line in enumerate(lines):
+        header = line.split('#')[0].strip()
+        if header in namelist:
+            offsets[header] = i
+
+    # Masses section: rows are 'id mass # type'. Sort once by atom type id
+    # instead of re-sorting on every line.
+    if "Masses" in offsets:
+        rows = [row.split() for row in _section_rows(lines, offsets["Masses"], 4)]
+        ids = np.array([int(row[0]) for row in rows])
+        masses = np.array([float(row[1]) for row in rows])
+        types = np.array([row[3].lower() for row in rows])
+        idx = np.argsort(ids)
+        state.lmp_id = ids[idx].tolist()
+        state.lmp_mass = masses[idx].tolist()
+        state.lmp_type = types[idx].tolist()
+        # Resolve the element name once per type so the per-atom loop
+        # below is a plain tuple lookup with no regex work
+        state.elname_by_type = tuple(map(extract_and_capitalize, state.lmp_type))
+
+    # Atoms section: one typed block read, then derive the per-atom
+    # type/element/charge lists as vectorized slices
+    if "Atoms" in offsets:
+        arr = np.loadtxt(_section_rows(lines, offsets["Atoms"], 7), ndmin=2)
+        type_ids = arr[:,2].astype(np.int64)
+        state.lmp_allids = type_ids.tolist()
+        state.lmp_alltypes = np.asarray(state.lmp_type)[type_ids-1].tolist()
+        state.lmp_allels = np.asarray(state.elname_by_type)[type_ids-1].tolist()
+        state.lmp_allcharges = arr[:,3].tolist()
+
+    # Topology sections are purely numeric; parse each as one typed block
+    def _load_section(name, ntokens):
+        rows = _section_rows(lines, offsets[name], ntokens)
+        arr = np.loadtxt(rows, dtype=np.int64, ndmin=2)
+        return arr[:,1].tolist(), list(map(tuple, arr[:,2:].tolist()))
+
+    if "Bonds" in offsets:
+        state.lmp_bondtype, state.lmp_bond_ids = _load_section("Bonds", 4)
+    if "Angles" in offsets:
+        state.lmp_angletype, state.lmp_angle_ids = _load_section("Angles", 5)
+    if "Dihedrals" in offsets:
+        state.lmp_dihedraltype, state.lmp_dihedral_ids = _load_section("Dihedrals", 6)
+    if "Impropers" in offsets:
+        state.lmp_impropertype, state.improper_atomids_list = _load_section("Impropers", 6)
+
+    # Map each bonded type to its first atom-id tuple so the coeff
+    # handlers can do O(1) lookups instead of list.index() scans
+    for mapping, types, ids in ((state.bondtype_to_ids, state.lmp_bondtype, state.lmp_bond_ids),
+                                (state.angletype_to_ids, state.lmp_angletype, state.lmp_angle_ids),
+                                (state.dihedraltype_to_ids, state.lmp_dihedraltype, state.lmp_dihedral_ids),
+                                (state.impropertype_to_ids, state.lmp_impropertype, state.improper_atomids_list)):
+        for t, atom_ids in zip(types, ids):
+            mapping.setdefault(t, atom_ids)
+
+    return state
 
 ## TO-DO: Update the documentation stings
 
-def _bond(line):
-    """Process LAMMPS harmonic bond style parameters into OpenMM HarmonicBondForce parameters. 
-    
-        Args: 
-            line (string): a string obtained from a line in LAMMPS data file
+def _bond(state, tokens):
+    """Process LAMMPS harmonic bond style parameters into OpenMM HarmonicBondForce parameters.
+
+        Args:
+            state (LmpState): parsed LAMMPS/PDB data
+            tokens (list): the whitespace-split fields of a LAMMPS settings line
 
         K: kcal/mol/(A**2)  ->  K/2: 2*kj/mol/nm**2 (scale factor 2)
         r: Ang                ->  nm
@@ -674,30 +704,31 @@ def _bond(line):
                    ^                         ^
                    K                         r
     """
-    llist     = line.split()
+    llist     = tokens
     bond_type = int(llist[1])
     k         = float(llist[2])
     r         = float(llist[3])
 
-    omm_k  = k*2*kcal2kj/(ang2nm*ang2nm)
+    omm_k  = k*bondk2omm
     omm_r  = r*ang2nm
     
-    idx = lmp_bondtype.index(bond_type)# = []
-    aid, bid = lmp_bond_ids[idx]
-    aid = lmp_alltypes[aid-1]
-    bid = lmp_alltypes[bid-1]
-    bond_style = bondstyles[0]
+    aid, bid = state.bondtype_to_ids[bond_type]
+    aid = state.lmp_alltypes[aid-1]
+    bid = state.lmp_alltypes[bid-1]
+    bond_style = state.bondstyles[0]
     omm_out = ' <Bond type1="{}" type2="{}" length="{}" k="{}"/>'.format(aid,bid,omm_r, omm_k)
     
-    print(omm_out)
+    if VERBOSE:
+        print(omm_out)
     return [bond_style,omm_out] 
 
 
-def _angle(line):
-    """Process LAMMPS harmonic angle style parameters into OpenMM HarmonicAngleForce parameters. 
-    
-        Args: 
-            line (string): a string obtained from a line in LAMMPS data file
+def _angle(state, tokens):
+    """Process LAMMPS harmonic angle style parameters into OpenMM HarmonicAngleForce parameters.
+
+        Args:
+            state (LmpState): parsed LAMMPS/PDB data
+            tokens (list): the whitespace-split fields of a LAMMPS settings line
         K: kcal/mol/(rad**2)  ->  K/2: 2*kj/mol/(rad**2) (scale factor 2)
         a: degrees            ->  rad
     ----
@@ -706,32 +737,33 @@ def _angle(line):
                     ^                         ^              
                     K                         a    
     """
-    llist  = line.split()
+    llist  = tokens
     angle_type = int(llist[1])
     k      = float(llist[2])
     a      = float(llist[3])
     
-    idx = lmp_angletype.index(angle_type)
-    aid, bid, cid = lmp_angle_ids[idx]
-    omm_t1 = lmp_alltypes[aid-1]
-    omm_t2 = lmp_alltypes[bid-1]
-    omm_t3 = lmp_alltypes[cid-1]
+    aid, bid, cid = state.angletype_to_ids[angle_type]
+    omm_t1 = state.lmp_alltypes[aid-1]
+    omm_t2 = state.lmp_alltypes[bid-1]
+    omm_t3 = state.lmp_alltypes[cid-1]
 
-    omm_k  = 2*k*kcal2kj
+    omm_k  = k*anglek2omm
     omm_a  = math.radians(a)
 
-    angle_style = anglestyles[0]
+    angle_style = state.anglestyles[0]
     omm_out = ' <Angle type1="{}" type2="{}" type3="{}" angle="{}" k="{}"/>'.format(omm_t1, omm_t2, omm_t3, omm_a, omm_k)
 
-    print(omm_out)
+    if VERBOSE:
+        print(omm_out)
     return [angle_style,omm_out]
 
 
-def _dihedral(line):
-    """Process LAMMPS dihedral style parameters into OpenMM PeriodicTorsionForce (for opls) or CustomTorsionForce (for fourier) parameters. 
-    
-        Args: 
-            line (string): a string obtained from a line in LAMMPS data file
+def _dihedral(state, tokens):
+    """Process LAMMPS dihedral style parameters into OpenMM PeriodicTorsionForce (for opls) or CustomTorsionForce (for fourier) parameters.
+
+        Args:
+            state (LmpState): parsed LAMMPS/PDB data
+            tokens (list): the whitespace-split fields of a LAMMPS settings line
         
         For opls style, we have four different force constants. Unit converrsion follows:
         K1,K2,K3,K4: kcal/mol                      ->  k1,k2,k3,k4: (1/2)kj/mol (scale factor 1/2)
@@ -756,38 +788,33 @@ def _dihedral(line):
     ----
     When not in hybrid mode, the specification of opls/fourier do not exist and so the length of 'line' argument decreases
     """
-    llist  = line.split()
-    
+    llist  = tokens
+
     #Check if we are in hybrid mode or not
     shift = 0
     dihedral_type = int(llist[1])
-    if len(dihedralstyles) > 1:
+    if len(state.dihedralstyles) > 1:
         shift = 1
-        dihedral_style = llist[1+shift] 
+        dihedral_style = llist[1+shift]
     else:
-        dihedral_style = dihedralstyles[0]
-    
-    idx = lmp_dihedraltype.index(dihedral_type)# = []
-    aid, bid, cid, did = lmp_dihedral_ids[idx]
-    omm_t4 = lmp_alltypes[aid-1]
-    omm_t3 = lmp_alltypes[bid-1]
-    omm_t2 = lmp_alltypes[cid-1]
-    omm_t1 = lmp_alltypes[did-1]
+        dihedral_style = state.dihedralstyles[0]
 
-    if dihedral_style == "opls":
-        k1 = float(llist[2+shift])/2
-        k2 = float(llist[3+shift])/2
-        k3 = float(llist[4+shift])/2
-        k4 = float(llist[5+shift])/2
+    aid, bid, cid, did = state.dihedraltype_to_ids[dihedral_type]
+    omm_t4 = state.lmp_alltypes[aid-1]
+    omm_t3 = state.lmp_alltypes[bid-1]
+    omm_t2 = state.lmp_alltypes[cid-1]
+    omm_t1 = state.lmp_alltypes[did-1]
 
-        omm_k1  = k1 * kcal2kj
-        omm_k2  = k2 * kcal2kj
-        omm_k3  = k3 * kcal2kj
-        omm_k4  = k4 * kcal2kj
+    if dihedral_style == "opls":
+        omm_k1  = float(llist[2+shift]) * oplsk2omm
+        omm_k2  = float(llist[3+shift]) * oplsk2omm
+        omm_k3  = float(llist[4+shift]) * oplsk2omm
+        omm_k4  = float(llist[5+shift]) * oplsk2omm
 
         omm_out = ' <Proper type1="{}" type2="{}" type3="{}" type4="{}" k1="{}" k2="{}" k3="{}" k4="{}" periodicity1="1" periodicity2="2" periodicity3="3" periodicity4="4" phase1="0.00" phase2="3.141592653589793" phase3="0.00" phase4="3.141592653589793"/>'.format(omm_t1, omm_t2, omm_t3, omm_t4, omm_k1, omm_k2, omm_k3, omm_k4)
 
-        print(omm_out)
+        if VERBOSE:
+            print(omm_out)
         return ["dihedral",dihedral_style,omm_out]
     
     elif dihedral_style == "fourier":
@@ -802,14 +829,16 @@ def _dihedral(line):
             omm_out += f' d{i+1}="{float(llist[3*i+5+shift])}"'
         omm_out += '/>'
         
-        print(omm_out)
+        if VERBOSE:
+            print(omm_out)
         return ["dihedral",dihedral_style,omm_out]
 
-def _improper(line):
-    """Process LAMMPS improper style parameters into OpenMM PeriodicTorsionForce (for opls) 
-    
-        Args: 
-            line (string): a string obtained from a line in LAMMPS data file
+def _improper(state, tokens):
+    """Process LAMMPS improper style parameters into OpenMM PeriodicTorsionForce (for opls)
+
+        Args:
+            state (LmpState): parsed LAMMPS/PDB data
+            tokens (list): the whitespace-split fields of a LAMMPS settings line
         
         K:kcal/mol                      ->  K: kj/mol
         periodicity(n): integer >= 0    ->  int
@@ -821,7 +850,7 @@ def _improper(line):
                        ^                       ^   ^          
                        K                       n   d   
     """
-    llist  = line.split()
+    llist  = tokens
     improper_type = int(llist[1])
     k = float(llist[2])
     d = float(llist[3]) 
@@ -831,12 +860,11 @@ def _improper(line):
         theta = 0.0
     n = float(llist[4])
 
-    idx = lmp_impropertype.index(improper_type)
-    aid, bid, cid, did = improper_atomids_list[idx]
-    omm_t4 = lmp_alltypes[aid-1]
-    omm_t3 = lmp_alltypes[bid-1]
-    omm_t2 = lmp_alltypes[cid-1]
-    omm_t1 = lmp_alltypes[did-1]
+    aid, bid, cid, did = state.impropertype_to_ids[improper_type]
+    omm_t4 = state.lmp_alltypes[aid-1]
+    omm_t3 = state.lmp_alltypes[bid-1]
+    omm_t2 = state.lmp_alltypes[cid-1]
+    omm_t1 = state.lmp_alltypes[did-1]
     
     omm_k  = k * kcal2kj
     omm_n  = n
@@ -844,16 +872,18 @@ def _improper(line):
 
     omm_out = ' <Improper type1="{}" type2="{}" type3="{}" type4="{}" periodicity1="{}" phase1="{}" k1="{}"/>'.format(omm_t1, omm_t2, omm_t3, omm_t4, int(omm_n),omm_theta,omm_k)
 
-    print(omm_out)
-    improper_style = improperstyles[0]
+    if VERBOSE:
+        print(omm_out)
+    improper_style = state.improperstyles[0]
     return ["improper",improper_style,omm_out]
 
 
-def _nonbonding(line):#,fixedtypes):
+def _nonbonding(state, tokens):#,fixedtypes):
     """Process LAMMPS lj/cut/long/coul style parameters into OpenMM NonbondedForce parameters
-    
-        Args: 
-            line (string): a string obtained from a line in LAMMPS data file
+
+        Args:
+            state (LmpState): parsed LAMMPS/PDB data
+            tokens (list): the whitespace-split fields of a LAMMPS settings line
         epsilon: kcal/mol       ->  kj/mol
         sigma  : angstrom       ->  nm       
     ----
@@ -863,15 +893,15 @@ def _nonbonding(line):#,fixedtypes):
                        epsilon                   sigma
     
     Any information related to cutoff parameters will be specified runtime (in the simulation script). OpenMM
-    only needs the LJ parameters and partial charge, which is read previously from invoking function _get_atoms 
+    only needs the LJ parameters and partial charge, which is read previously by grab_lmpdata_attr
     """  
-    llist = line.split()
+    llist = tokens
 
     atom_id1 = llist[1]
-    omm_t1 = lmp_type[int(atom_id1)-1]
-    
+    omm_t1 = state.lmp_type[int(atom_id1)-1]
+
     atom_id2 = llist[2]
-    omm_t2 = lmp_type[int(atom_id2)-1]
+    omm_t2 = state.lmp_type[int(atom_id2)-1]
     
     epsilon    = float(llist[3]) 
     sigma      = float(llist[4]) 
@@ -881,11 +911,13 @@ def _nonbonding(line):#,fixedtypes):
     # only output LJ pairs with same atom type
     # if type is not the same, we ignore
     if atom_id1 == atom_id2:
-        idx = lmp_allids.index(int(atom_id1))
-        omm_charge = lmp_allcharges[idx]# = []
+        idx = state.lmp_allids.index(int(atom_id1))
+        omm_charge = state.lmp_allcharges[idx]# = []
         omm_out = ' <Atom type="{}" charge="{}" sigma="{}" epsilon="{}"/>'.format(omm_t2, omm_charge, omm_sigma, omm_epsilon)
-        print(omm_out)
+        if VERBOSE:
+            print(omm_out)
     else:
-        print(CGREY + line.strip() + CEND)
+        if VERBOSE:
+            print(CGREY + " ".join(tokens) + CEND)
         omm_out=""
     return [omm_out]
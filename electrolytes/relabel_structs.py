@@ -7,29 +7,57 @@ import glob
 import os
 import multiprocessing as mp
 from collections import defaultdict
+
+import numpy as np
 from tqdm import tqdm
 from schrodinger.comparison import are_conformers
 from schrodinger.structure import StructureWriter, StructureReader
 from schrodinger.application.desmond.packages import traj_util
 from schrodinger.application.desmond.packages import traj, topo
 from schrodinger.application.desmond.constants import CMS_POINTER, TRJ_POINTER
-from schrodinger.application.jaguar.utils import get_stoichiometry_string, group_with_comparison
+from schrodinger.application.jaguar.utils import group_with_comparison
 from schrodinger.structutils.color import apply_color_scheme
 
 def get_res_dict(st):
     if len(set(res.pdbres.strip() for res in st.residue)-{'T3P'}) > 1:
         relabel_t3p(st)
         return {}
+    # Fetch the per-atom properties once; residue keys then come from array
+    # slices instead of per-atom property lookups inside the residue loop
+    anums = np.fromiter(
+        (at.atomic_number for at in st.atom), dtype=int, count=st.atom_total
+    )
+    charges = np.fromiter(
+        (at.formal_charge for at in st.atom), dtype=int, count=st.atom_total
+    )
     res_dict = defaultdict(list)
     for res in st.residue:
-        res_dict[(get_stoichiometry_string([at.element for at in res.atom]), sum(at.formal_charge for at in res.atom))].append(res)
+        # Bucket on the sorted atomic numbers rather than the stoichiometry
+        # string; it is the same partition but skips the per-residue string
+        # formatting
+        at_idxs = np.asarray(res.getAtomIndices()) - 1
+        key = (tuple(np.sort(anums[at_idxs]).tolist()),
+               int(charges[at_idxs].sum()))
+        res_dict[key].append(res)
     split_res_dict = {}
     for key, vals in res_dict.items():
-        if key[1] != 0:
+        if key[1] != 0 or len(vals) == 1:
             split_res_dict[key] = vals
             continue
         res_map = {res.extractStructure(): res for res in vals}
-        grouped_neutral = group_with_comparison(list(res_map), are_conformers)
+        # Pre-bucket on a cheap graph invariant so the O(k^2) conformer
+        # comparison only runs within buckets that could actually match
+        buckets = defaultdict(list)
+        for st_res in res_map:
+            buckets[tuple(sorted(
+                (at.atomic_number, at.bond_total) for at in st_res.atom
+            ))].append(st_res)
+        grouped_neutral = []
+        for bucket in buckets.values():
+            if len(bucket) == 1:
+                grouped_neutral.append(bucket)
+            else:
+                grouped_neutral.extend(group_with_comparison(bucket, are_conformers))
         if len(grouped_neutral) == 1:
             split_res_dict[key] = vals
             continue
@@ -76,12 +104,12 @@ def generate_frames(dir_name):
     fsys_st = cms_model.fsys_ct.copy()
     for prop in (CMS_POINTER, TRJ_POINTER):
         fsys_st.property.pop(prop, None)
-    st_list = []
-    for fr in tr:
-        topo.update_fsys_ct_from_frame_GF(fsys_st, cms_model, fr)
-        st_list.append(fsys_st.copy())
+    # Stream frames straight to the writer; it serializes on append, so one
+    # reusable structure replaces a full trajectory's worth of copies
     with StructureWriter(maegz_name) as writer:
-        writer.extend(st_list)
+        for fr in tr:
+            topo.update_fsys_ct_from_frame_GF(fsys_st, cms_model, fr)
+            writer.append(fsys_st)
 
 def parse_args():
     parser = argparse.ArgumentParser()
@@ -89,10 +117,15 @@ def parse_args():
     return parser.parse_args()
 
 def main():
-    pool = mp.Pool(60)
     args = parse_args()
     dir_list = glob.glob(os.path.join(args.output_path, '*'))
-    list(tqdm(pool.imap(generate_frames, dir_list), total=len(dir_list)))
+    if not dir_list:
+        return
+    nproc = min(60, len(dir_list), os.cpu_count())
+    chunksize = max(1, len(dir_list) // (nproc * 4))
+    with mp.get_context("fork").Pool(nproc) as pool:
+        list(tqdm(pool.imap_unordered(generate_frames, dir_list, chunksize=chunksize),
+                  total=len(dir_list)))
 
 if __name__ == "__main__":
     main()
@@ -1,7 +1,9 @@
 import argparse
 import csv
-import glob
+import hashlib
 import os
+import pickle
+from pathlib import Path
 
 import openmm.app as app
 from openmm import *
@@ -94,6 +96,61 @@ class RPMDPDBReporter(object):
                 f.close()
 
 
+def load_forcefield(xml_path):
+    """
+    Parse a force-field XML file, caching the parsed object on disk.
+
+    Batch sweeps pay the multi-MB XML parse once per job otherwise; the
+    parsed ForceField is immutable for our purposes, so pickle it keyed
+    on the content hash and the OpenMM version and reuse it across
+    invocations. The cache lives in a per-user mode-0700 directory:
+    unpickling from a world-writable path like /tmp would let any local
+    user on a shared node plant a pickle for a known system.xml.
+    """
+    with open(xml_path, "rb") as f:
+        digest = hashlib.blake2b(
+            Platform.getOpenMMVersion().encode() + f.read()
+        ).hexdigest()
+    cache_dir = os.path.join(
+        os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+        "omol_forcefields",
+    )
+    cache = os.path.join(cache_dir, f"ff_{digest}.pkl")
+    if os.path.exists(cache):
+        try:
+            with open(cache, "rb") as f:
+                return pickle.load(f)
+        except Exception:
+            pass  # stale or corrupt cache; fall through and re-parse
+    forcefield = app.ForceField(xml_path)
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        with open(cache, "wb") as f:
+            pickle.dump(forcefield, f)
+    except OSError:
+        pass
+    return forcefield
+
+
+def create_simulation(topology, system, integrator):
+    """
+    Build a Simulation on the fastest platform available.
+
+    Without an explicit platform OpenMM can silently land on the CPU;
+    prefer CUDA with mixed precision (FP32 forces, FP64 accumulation),
+    then OpenCL, then whatever OpenMM picks by default.
+    """
+    for platform_name in ("CUDA", "OpenCL"):
+        try:
+            platform = Platform.getPlatformByName(platform_name)
+            return app.Simulation(
+                topology, system, integrator, platform, {"Precision": "mixed"}
+            )
+        except Exception:
+            continue
+    return app.Simulation(topology, system, integrator)
+
+
 def main(row_idx: int, job_dir: str, rpmd: bool, nbeads: int):
     """
     Main job driver
@@ -116,7 +173,7 @@ def main(row_idx: int, job_dir: str, rpmd: bool, nbeads: int):
     os.chdir(os.path.join(job_dir, str(row_idx)))
     pdb = app.PDBFile("system_equil.pdb")
     modeller = app.Modeller(pdb.topology, pdb.positions)
-    forcefield = app.ForceField("system.xml")
+    forcefield = load_forcefield("system.xml")
     rdist = 1.0 * nanometer
     system = forcefield.createSystem(
         modeller.topology,
@@ -140,7 +197,7 @@ def main(row_idx: int, job_dir: str, rpmd: bool, nbeads: int):
             dt * picosecond,
         )  # Time step
     
-    simulation = app.Simulation(modeller.topology, system, integrator)
+    simulation = create_simulation(modeller.topology, system, integrator)
     rate = max(1, int(runtime / frames))
     if os.path.exists("md.chk") or not rpmd:
         simulation.loadCheckpoint("md.chk")
@@ -158,17 +215,30 @@ def main(row_idx: int, job_dir: str, rpmd: bool, nbeads: int):
         # Extract the box dimensions (lengths of the box vectors)
         box_lengths = [box_vectors[i][i].value_in_unit(unit.nanometer) for i in range(3)]
         print("Box dimensions (nm):", box_lengths)
-        simulation.minimizeEnergy()
+        # equilsystem.state already reflects a minimized structure on
+        # restarts; a sentinel file lets us skip the redundant minimization
+        if not os.path.exists("minimized.flag"):
+            simulation.minimizeEnergy()
+            Path("minimized.flag").touch()
         if rpmd:
             system.addForce(RPMDMonteCarloBarostat(1*bar, 100))
             simulation.context.reinitialize(preserveState=True)
         restart = False
 
-    # Get name for PDBReporter (OpenMM cannot add to an existing .pdb file for restarts)
+    # Get name for the trajectory reporter (OpenMM cannot add to an existing
+    # trajectory file for restarts)
     output_pdb_basename = "system_output"
-    other_name = sorted(glob.glob(output_pdb_basename + "*.pdb"))
-    if other_name and other_name[-1] != output_pdb_basename + ".pdb":
-        last_name = other_name[-1].replace(".pdb", "")
+    traj_ext = ".pdb" if rpmd else ".dcd"
+    # scandir avoids the per-entry stat that glob pays in large job dirs
+    with os.scandir(".") as entries:
+        other_name = sorted(
+            entry.name
+            for entry in entries
+            if entry.name.startswith(output_pdb_basename)
+            and entry.name.endswith(traj_ext)
+        )
+    if other_name and other_name[-1] != output_pdb_basename + traj_ext:
+        last_name = other_name[-1].replace(traj_ext, "")
         if rpmd:
             count = int(last_name.split("_")[-3]) + 1
         else:
@@ -181,7 +251,7 @@ def main(row_idx: int, job_dir: str, rpmd: bool, nbeads: int):
         simulation.reporters.append(RPMDPDBReporter(output_name, rate, enforcePeriodicBox=True,nbeads=nbeads))
     else:
         simulation.reporters.append(
-            app.PDBReporter(output_name+".pdb", rate, enforcePeriodicBox=True)
+            app.DCDReporter(output_name + ".dcd", rate, enforcePeriodicBox=True)
         )
     simulation.reporters.append(
         app.StateDataReporter(
@@ -5,8 +5,10 @@ logging.basicConfig(level=logging.INFO)
 
 import argparse
 import json
+import multiprocessing as mp
 import os
 import random
+from functools import partial
 from tqdm import tqdm
 
 import numpy as np
@@ -30,6 +32,12 @@ def neutralize_tempo(st, tempo_res):
     for at in evaluate_asl(st, f'res {tempo_res}'):
         st.atom[at].formal_charge = 0
 
+def seed_worker():
+    # Forked workers inherit the parent's random state, so without a
+    # reseed every worker would sample the same molecule indices from
+    # corresponding frames
+    random.seed(os.getpid() ^ int.from_bytes(os.urandom(8), "little"))
+
 def extract_solvation_shells(
     input_dir: str,
     save_dir: str,
@@ -106,21 +114,24 @@ def extract_solvation_shells(
                 )
                 if os.path.exists(save_path):
                     continue
-                for i, st in tqdm(
-                    enumerate(structures), total=len(structures)
-                ):  # loop over timesteps
-
-                    # extract shells from the structure, centered on the residue type
-                    extracted_shells.extend(
-                        extract_shells_from_structure(
-                            st,
-                            radius,
-                            residue,
-                            spec_type,
-                            shells_per_frame,
-                            max_shell_size,
-                        )
-                    )
+                # extract shells from each frame, centered on the residue
+                # type; frames are independent, so farm them out to a pool
+                extract = partial(
+                    extract_shells_from_structure,
+                    radius=radius,
+                    residue=residue,
+                    spec_type=spec_type,
+                    shells_per_frame=shells_per_frame,
+                    max_shell_size=max_shell_size,
+                )
+                nproc = min(len(structures), os.cpu_count())
+                chunksize = max(1, len(structures) // (nproc * 2))
+                with mp.get_context("fork").Pool(nproc, initializer=seed_worker) as pool:
+                    for shells in tqdm(
+                        pool.imap_unordered(extract, structures, chunksize=chunksize),
+                        total=len(structures),
+                    ):  # loop over timesteps
+                        extracted_shells.extend(shells)
 
                 if not extracted_shells:
                     # raise a warning and continue to the next radii/species
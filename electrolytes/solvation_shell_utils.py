@@ -1,4 +1,6 @@
+import os
 import random
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Set
 from tqdm import tqdm
 import logging
@@ -6,10 +8,11 @@ from collections import Counter
 
 
 import numpy as np
+from scipy.spatial import cKDTree
 from schrodinger.comparison.atom_mapper import ConnectivityAtomMapper
 from schrodinger.comparison import are_conformers
 from schrodinger.structure import Structure
-from schrodinger.structutils import analyze, rmsd
+from schrodinger.structutils import rmsd
 from schrodinger.application.jaguar.utils import group_with_comparison
 from schrodinger.application.matsci import clusterstruct
 from schrodinger.application.jaguar.utils import get_stoichiometry_string
@@ -61,32 +64,54 @@ def extract_shells_from_structure(
         molecules = random.sample(molecules, shells_per_frame)
 
     central_mol_nums = list({mol.molecule_number for mol in molecules})
-    # Extract solvation shells
-    shells = [
-        set(analyze.evaluate_asl(st, f"fillres within {radius} mol {mol_num}"))
-        for mol_num in central_mol_nums
-    ]
+
+    # Build the neighbor tree and atom->residue maps once; each shell is then
+    # the ASL "fillres within radius mol N" computed as a set of tree queries
+    # instead of a full ASL evaluation per central molecule
+    xyz = st.getXYZ()
+    tree = cKDTree(xyz)
+    n_res = 0
+    res_of_atom = np.empty(st.atom_total, dtype=int)
+    for res_idx, res in enumerate(st.residue):
+        res_of_atom[np.asarray(res.getAtomIndices()) - 1] = res_idx
+        n_res = res_idx + 1
+
+    # Extract solvation shells, each held as a boolean mask over 1-indexed
+    # atom numbers rather than a set of boxed Python ints
+    shells = []
+    for mol_num in central_mol_nums:
+        mol_ats = np.asarray(st.molecule[mol_num].getAtomIndices()) - 1
+        neighbors = tree.query_ball_point(xyz[mol_ats], r=radius)
+        hit_atoms = np.unique(
+            np.concatenate([np.asarray(hits, dtype=int) for hits in neighbors])
+        )
+        # fill out each hit residue in one vectorized pass
+        hit_res = np.zeros(n_res, dtype=bool)
+        hit_res[res_of_atom[hit_atoms]] = True
+        shell = np.zeros(st.atom_total + 1, dtype=bool)
+        shell[1:] = hit_res[res_of_atom]
+        shells.append(shell)
 
     if spec_type == "solvent":
         # Only keep the shells that have no solute atoms and below a maximum size
-        solute_atoms = st.chain["A"].getAtomList()
+        solute_ats = np.asarray(st.chain["A"].getAtomList())
         shells = [
             (shell, central_mol)
             for shell, central_mol in zip(shells, central_mol_nums)
-            if len(shell) <= max_shell_size and (not shell.intersection(solute_atoms))
+            if shell.sum() <= max_shell_size and not shell[solute_ats].any()
         ]
         extracted_shells = [
-            extract_contracted_shell(st, at_list, central_mol)
-            for at_list, central_mol in shells
+            extract_contracted_shell(st, np.flatnonzero(shell).tolist(), central_mol)
+            for shell, central_mol in shells
         ]
 
     elif spec_type == "solute":
         extracted_shells = []
-        for shell_ats, central_solute in zip(shells, central_mol_nums):
-            if len(shell_ats) > max_shell_size:
+        for shell, central_solute in zip(shells, central_mol_nums):
+            if shell.sum() > max_shell_size:
                 continue
             expanded_shell = extract_contracted_shell(
-                st, shell_ats, central_solute
+                st, np.flatnonzero(shell).tolist(), central_solute
             )
 
             if expanded_shell.atom_total <= max_shell_size:
@@ -141,7 +166,10 @@ def group_shells(shell_list: list[Structure], spec_type: str) -> list[list[Struc
     # Now compare the expanded shells and group them by similarity
     # we will get lists of lists of shells where each list of structures are conformers of each other
     logging.info("Grouping solvation shells into conformers")
-    grouped_shells = group_with_comparison(shell_list, are_isomeric_molecules)
+    isomer_buckets = {}
+    for st in shell_list:
+        isomer_buckets.setdefault(isomeric_molecules_key(st), []).append(st)
+    grouped_shells = list(isomer_buckets.values())
     logging.info("Grouped into isomers")
 
     if spec_type == "solute":
@@ -190,30 +218,21 @@ def get_species_from_res(res):
         label += f'{charge}'
     return label
 
-def are_isomeric_molecules(st1: Structure, st2: Structure) -> bool:
+def isomeric_molecules_key(st: Structure):
     """
-    Determine if two structures have molecules which are isomers of each other.
+    Hashable key under which two structures compare equal exactly when their
+    molecules are isomers of each other (same number of molecules with the
+    same per-molecule compositions).
 
     This is stronger than just ensuring that the structures are isomers and should
     be sufficient for cases of just solvents as there are no expected topological
-    differences.
+    differences. Bucketing on the key replaces pairwise O(k^2) comparisons.
     """
-    isomers = st1.atom_total == st2.atom_total and st1.mol_total == st2.mol_total
-    if isomers:
-        isomers = Counter(at.atomic_number for at in st1.atom) == Counter(
-            at.atomic_number for at in st2.atom
-        )
-    if isomers:
-        cnt1 = Counter(
-            frozenset(Counter(at.atomic_number for at in mol.atom).items())
-            for mol in st1.molecule
-        )
-        cnt2 = Counter(
-            frozenset(Counter(at.atomic_number for at in mol.atom).items())
-            for mol in st2.molecule
-        )
-        isomers = cnt1 == cnt2
-    return isomers
+    mol_compositions = Counter(
+        frozenset(Counter(at.atomic_number for at in mol.atom).items())
+        for mol in st.molecule
+    )
+    return (st.atom_total, st.mol_total, frozenset(mol_compositions.items()))
 
 
 def groupby_molecules_are_conformers(st_list: list[Structure]) -> list[list[Structure]]:
@@ -261,6 +280,34 @@ def groupby_molecules_are_conformers(st_list: list[Structure]) -> list[list[Stru
     return conf_groups
 
 
+def pairwise_rmsd_matrix(shells: List[Structure]) -> np.ndarray:
+    """
+    Compute the full pairwise superimposed-RMSD matrix for a set of structures
+    with identical atom numbering.
+
+    All of the work happens in batched NumPy (the optimal rotation comes from
+    an SVD of the 3x3 cross-covariance of every pair), so this is much faster
+    than O(n^2) individual Schrodinger RMSD calls. The structures must already
+    be equivalently numbered (e.g. via `renumber_molecules_to_match`) since no
+    symmetry handling is done here.
+
+    :param shells: list of structures, all with the same atom count
+    :return: (n, n) matrix of RMSDs between each pair of structures
+    """
+    coords = np.array([st.getXYZ() for st in shells], dtype=np.float32)
+    coords -= coords.mean(axis=1, keepdims=True)
+    n_atoms = coords.shape[1]
+    sq_norms = np.einsum("nij,nij->n", coords, coords)
+    # Cross-covariance of every pair of conformers
+    cov = np.einsum("mia,nib->mnab", coords, coords)
+    u, s, vt = np.linalg.svd(cov)
+    # Correct the smallest singular value for pairs whose optimal "rotation"
+    # would otherwise be a reflection
+    s[..., -1] *= np.sign(np.linalg.det(u @ vt))
+    msd = (sq_norms[:, None] + sq_norms[None, :] - 2 * s.sum(axis=-1)) / n_atoms
+    return np.sqrt(np.maximum(msd, 0.0))
+
+
 def filter_by_rmsd(shells: List[Structure], n: int = 20) -> List[Structure]:
     """
     From a set of shell coordinates, determine the n most diverse shells, where "most diverse" means "most different, in terms of minimum RMSD.
@@ -275,17 +322,19 @@ def filter_by_rmsd(shells: List[Structure], n: int = 20) -> List[Structure]:
         List of n Schrodinger structures that are the most diverse in terms of minimum RMSD
     """
 
+    rmsd_matrix = pairwise_rmsd_matrix(shells)
     seed_point = random.randint(0, len(shells) - 1)
-    final_shell_idxs = {seed_point}
-    min_rmsds = np.array([rmsd_wrapper(shells[seed_point], shell) for shell in shells])
+    selected = np.zeros(len(shells), dtype=bool)
+    selected[seed_point] = True
+    min_rmsds = rmsd_matrix[seed_point].copy()
+    # mask out selected shells so argmax never revisits them
+    min_rmsds[seed_point] = -np.inf
     for _ in range(n - 1):
-        best = np.argmax(min_rmsds)
-        min_rmsds = np.minimum(
-            min_rmsds,
-            np.array([rmsd_wrapper(shells[best], shell) for shell in shells]),
-        )
-        final_shell_idxs.add(best)
-    return [shells[i] for i in final_shell_idxs]
+        best = int(np.argmax(min_rmsds))
+        selected[best] = True
+        np.minimum(min_rmsds, rmsd_matrix[best], out=min_rmsds)
+        min_rmsds[best] = -np.inf
+    return [shells[i] for i in np.flatnonzero(selected)]
 
 
 def rmsd_wrapper(st1: Structure, st2: Structure) -> float:
@@ -295,7 +344,9 @@ def rmsd_wrapper(st1: Structure, st2: Structure) -> float:
     assert (
         st1.atom_total == st2.atom_total
     ), "Structures must have the same number of atoms for RMSD calculation"
-    if st1 == st2:
+    # Bitwise-identical coordinates (e.g. duplicate shells from consecutive
+    # frames) skip the symmetry-aware superposition outright
+    if st1 == st2 or np.array_equal(st1.getXYZ(), st2.getXYZ()):
         return 0.0
     at_list = list(range(1, st1.atom_total + 1))
     return rmsd.superimpose(st1, at_list, st2.copy(), at_list, use_symmetry=True)
@@ -305,10 +356,21 @@ def renumber_molecules_to_match(mol_list):
     """
     Ensure that topologically equivalent sites are equivalently numbered
     """
-    mapper = ConnectivityAtomMapper(use_chirality=False)
+    if len(mol_list) == 1:
+        return mol_list
     atlist = range(1, mol_list[0].atom_total + 1)
-    renumbered_mols = [mol_list[0]]
-    for mol in mol_list[1:]:
+
+    def renumber(mol):
+        # the mapper is not documented thread-safe and carries per-call
+        # state, so each call gets its own throwaway instance; building
+        # one is negligible next to reorder_structures
+        mapper = ConnectivityAtomMapper(use_chirality=False)
         _, r_mol = mapper.reorder_structures(mol_list[0], atlist, mol, atlist)
-        renumbered_mols.append(r_mol)
+        return r_mol
+
+    # threads avoid pickling Structures; reorder_structures spends its
+    # time in Schrodinger C code
+    max_workers = min(len(mol_list) - 1, os.cpu_count())
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        renumbered_mols = [mol_list[0]] + list(executor.map(renumber, mol_list[1:]))
     return renumbered_mols
@@ -16,6 +16,15 @@ from omdata.orca.calc import (
     get_symm_break_block,
 )
 
+# Resolved once at import: counting physical cores reads per-CPU sysfs
+# topology files on every call, and the answer never changes mid-run.
+# OMDATA_NPROCS lets orchestration pin the count without patching callers.
+_PHYS_CORES = (
+    int(os.environ.get("OMDATA_NPROCS", 0))
+    or psutil.cpu_count(logical=False)
+    or os.cpu_count()
+)
+
 
 def single_point_calculation(
     atoms,
@@ -79,7 +88,7 @@ def single_point_calculation(
     else:
         orcablocks.append(NBO_FLAGS)
 
-    nprocs = psutil.cpu_count(logical=False) if nprocs == "max" else nprocs
+    nprocs = _PHYS_CORES if nprocs == "max" else nprocs
     default_inputs = [xc, basis, "engrad"]
     default_blocks = [f"%pal nprocs {nprocs} end"]
 
@@ -168,7 +177,7 @@ def ase_relaxation(
     else:
         orcablocks.append(NBO_FLAGS)
 
-    nprocs = psutil.cpu_count(logical=False) if nprocs == "max" else nprocs
+    nprocs = _PHYS_CORES if nprocs == "max" else nprocs
     default_inputs = [xc, basis, "engrad"]
     default_blocks = [f"%pal nprocs {nprocs} end"]
 
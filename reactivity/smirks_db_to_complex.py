@@ -1,50 +1,72 @@
-from typing import List, Tuple
+from __future__ import annotations
 
-from more_itertools import collapse
-from rdkit import Chem
+import argparse
+import copy
+import csv
+import logging
+import math
+import multiprocessing as mp
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import chain, islice
+from typing import TYPE_CHECKING, List, Tuple
+
+import numpy as np
+from rdkit import Chem, RDLogger
 from rdkit.Chem import AllChem
-from schrodinger.application.jaguar.autots_input import AutoTSInput
-from schrodinger.application.jaguar.file_logger import FileLogger
-from schrodinger.application.jaguar.packages.autots_modules.active_bonds import (
-    mark_active_bonds,
-)
-from schrodinger.application.jaguar.packages.autots_modules.complex_formation import (
-    _add_atom_transfer_dummies,
-    _remove_atom_transfer_dummies,
-    minimize_path_distance,
-    reaction_center,
-    translate_close,
-)
-from schrodinger.application.jaguar.packages.autots_modules.renumber import (
-    build_reaction_complex,
-)
-from schrodinger.application.jaguar.packages.reaction_mapping import (
-    build_reaction_complex as get_renumbered_complex,
-)
-from schrodinger.application.jaguar.packages.reaction_mapping import flatten_st_list
-from schrodinger.rdkit import rdkit_adapter
-from schrodinger.structure import Structure, StructureWriter
+
+# Sanitization warnings for every odd valence are pure stderr contention
+# once many workers run in parallel
+RDLogger.DisableLog("rdApp.*")
+
+if TYPE_CHECKING:
+    from schrodinger.structure import Structure
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 """
 Convert Reaction SMIRKS (from RMechDB/PMechDB) to 3D fully mapped complexes.
+
+The Schrodinger imports are deliberately function-local: they take the
+better part of a second and are not needed to parse arguments, slice the
+CSV, or dedupe a batch.
 """
 
 
-class local_rinp(AutoTSInput):
-    """
-    Need a patched version that I can populated programatically easily
-    """
+# AutoTSInput construction is surprisingly expensive, so one template is
+# built lazily and shallow-copied per reaction
+_rinp_template = None
+
 
-    def __init__(self, reactants, products):
-        super().__init__()
-        self.reactants = reactants
-        self.products = products
+def get_rinp(reactants, products):
+    global _rinp_template
+    if _rinp_template is None:
+        from schrodinger.application.jaguar.autots_input import AutoTSInput
 
-    def getReactants(self):
-        return self.reactants
+        class local_rinp(AutoTSInput):
+            """
+            Need a patched version that I can populated programatically easily
+            """
 
-    def getProducts(self):
-        return self.products
+            def __init__(self, reactants, products):
+                super().__init__()
+                self.reactants = reactants
+                self.products = products
+
+            def getReactants(self):
+                return self.reactants
+
+            def getProducts(self):
+                return self.products
+
+        _rinp_template = local_rinp([], [])
+        _rinp_template.values.debug = False
+    rinp = copy.copy(_rinp_template)
+    rinp.reactants = reactants
+    rinp.products = products
+    return rinp
 
 
 def build_complexes(
@@ -58,8 +80,21 @@ def build_complexes(
     able to use it. Hence, I've also written a minimal version that will
     at least work if not as well as the Schrodinger one.
     """
-    rinp = local_rinp(reactants, products)
-    rinp.values.debug = False
+    from schrodinger.application.jaguar.file_logger import FileLogger
+    from schrodinger.application.jaguar.packages.autots_modules.active_bonds import (
+        mark_active_bonds,
+    )
+    from schrodinger.application.jaguar.packages.autots_modules.renumber import (
+        build_reaction_complex,
+    )
+    from schrodinger.application.jaguar.packages.reaction_mapping import (
+        build_reaction_complex as get_renumbered_complex,
+    )
+    from schrodinger.application.jaguar.packages.reaction_mapping import (
+        flatten_st_list,
+    )
+
+    rinp = get_rinp(reactants, products)
     reactants, products = mark_active_bonds(
         reactants, products, max_n_active_bonds=10, water_wire=False
     )
@@ -85,8 +120,16 @@ def build_complexes(
 
 
 def minimal_form_reaction_complex(
-    reactant: Structure, product: Structure, rinp: local_rinp
+    reactant: Structure, product: Structure, rinp
 ) -> Tuple[Structure, Structure]:
+    from schrodinger.application.jaguar.packages.autots_modules.complex_formation import (
+        _add_atom_transfer_dummies,
+        _remove_atom_transfer_dummies,
+        minimize_path_distance,
+        reaction_center,
+        translate_close,
+    )
+
     reactant_out = reactant.copy()
     product_out = product.copy()
 
@@ -121,47 +164,212 @@ def minimal_form_reaction_complex(
 # I = rdkit_adapter.from_rdkit(I)
 # rxn_list = {'name':([nh3I],[nh3,I])}
 
-rxn_smirks = "[Li:11][CH2:10]CCC[CH:20]=[CH:21][C:22](=[O:23])OC(C)(C)C.CCCCI>>[Li+:11].CCCCI.CC(C)(C)O[C:22](=[CH:21][CH:20]1[CH2:10]CCC1)[O-:23] 10"
-rxn = AllChem.ReactionFromSmarts(rxn_smirks)
-# Add 3D to RDKit
-r_mols = [Chem.AddHs(mol) for mol in rxn.GetReactants()]
-p_mols = [Chem.AddHs(mol) for mol in rxn.GetProducts()]
-for mol in collapse((r_mols, p_mols)):
-    AllChem.EmbedMolecule(mol)
-
-reactants = [rdkit_adapter.from_rdkit(mol) for mol in r_mols]
-products = [rdkit_adapter.from_rdkit(mol) for mol in p_mols]
-rxn_st = []
-
-# *MechDBs sometimes include molecules with no mapped atoms which
-# seem to be spectators. We exclude these molecules from the reaction
-# complexes
-for st_list in (reactants, products):
-    rxn_st.append(
-        [
-            st
-            for st in st_list
-            if any("i_rdkit_molAtomMapNumber" in at.property for at in st.atom)
-        ]
+def has_mapped_atoms(mol):
+    return any(at.GetAtomMapNum() for at in mol.GetAtoms())
+
+
+@lru_cache(maxsize=None)
+def parse_smirks(smirks):
+    """
+    Parse a reaction SMIRKS, memoized on the raw string.
+
+    The dedupe pass in main parses every batch row once; fork-context
+    workers inherit that warm cache, so process_one never re-parses.
+    """
+    return AllChem.ReactionFromSmarts(smirks)
+
+
+def get_rxn_st(smirks):
+    """
+    Parse a reaction SMIRKS into lists of reactant and product Structures
+    with 3D coordinates.
+    """
+    from schrodinger.rdkit import rdkit_adapter
+
+    rxn = parse_smirks(smirks)
+    # *MechDBs sometimes include molecules with no mapped atoms which
+    # seem to be spectators. We exclude these molecules from the reaction
+    # complexes; dropping them on the RDKit side means they are never
+    # protonated, embedded, or converted
+    r_mols = [mol for mol in rxn.GetReactants() if has_mapped_atoms(mol)]
+    p_mols = [mol for mol in rxn.GetProducts() if has_mapped_atoms(mol)]
+    if not r_mols or not p_mols:
+        # nothing to build a complex from; fail before paying for any
+        # sanitization, protonation, or embedding
+        raise ValueError("no mapped molecules on one side of the reaction")
+    # Molecules come out of ReactionFromSmarts unsanitized; sanitizing in
+    # place is much cheaper than the usual SMILES round-trip
+    for mol in chain(r_mols, p_mols):
+        try:
+            Chem.SanitizeMol(mol)
+        except Chem.AtomValenceException:
+            # odd valences are common on mapped radical atoms in the
+            # mechanism DBs; keep the molecule rather than failing the
+            # whole reaction and redo perception without the strict
+            # valence check
+            mol.UpdatePropertyCache(strict=False)
+            Chem.SanitizeMol(
+                mol,
+                sanitizeOps=Chem.SanitizeFlags.SANITIZE_ALL
+                ^ Chem.SanitizeFlags.SANITIZE_PROPERTIES,
+            )
+    # Add 3D to RDKit
+    r_mols = [Chem.AddHs(mol) for mol in r_mols]
+    p_mols = [Chem.AddHs(mol) for mol in p_mols]
+    # RDKit's distance-geometry embed releases the GIL, so threads spread the
+    # per-molecule embeds across cores
+    all_mols = r_mols + p_mols
+    with ThreadPoolExecutor(max_workers=min(len(all_mols), os.cpu_count())) as executor:
+        list(executor.map(AllChem.EmbedMolecule, all_mols))
+
+    reactants = [rdkit_adapter.from_rdkit(mol) for mol in r_mols]
+    products = [rdkit_adapter.from_rdkit(mol) for mol in p_mols]
+    return [reactants, products]
+
+
+def atomic_numbers(st):
+    return np.fromiter(
+        (at.atomic_number for at in st.atom), dtype=np.int16, count=st.atom_total
     )
 
-rxn_list = {"name": rxn_st}
 
+def is_matter_balanced(reactants, products):
+    """
+    Check that both sides of a reaction carry identical element counts.
 
-for name, rxn in rxn_list.items():
-    try:
-        for st in collapse(rxn):
-            st.generate3dConformation(require_stereo=False)
-    except Exception:
-        print('SDGR graph to 3D generation failed. Probably no Canvas license. Proceeding with RDKit 3D coords')
+    Unbalanced sides (usually partially mapped spectators in the source
+    DB) can only fail later inside the complex build, so they are cheap
+    to reject up front.
+    """
+    r_z = np.concatenate([atomic_numbers(st) for st in reactants])
+    p_z = np.concatenate([atomic_numbers(st) for st in products])
+    return np.array_equal(
+        np.bincount(r_z, minlength=119), np.bincount(p_z, minlength=119)
+    )
+
+
+def process_one(task):
+    """
+    Build the reactant/product complexes for one (idx, smirks) task.
+
+    The SMIRKS is re-parsed inside the worker so only plain strings cross
+    the pickle boundary on the way in.
+    """
+    idx, smirks = task
+    # redundant under fork but spawn-based pools start with a fresh logger
+    RDLogger.DisableLog("rdApp.*")
+    # The structures already carry the RDKit ETKDG coordinates from
+    # from_rdkit, so no Schrodinger 3D generation pass is needed here
     try:
+        rxn = get_rxn_st(smirks)
+        if not is_matter_balanced(*rxn):
+            logger.warning("reaction %d does not conserve matter; skipping", idx)
+            return None
         r, p = build_complexes(*rxn)
-    except Exception as e:
-        print(e)
-        continue
-    else:
-        # Stick the total charge in the comment line of the .xyz
-        r.title = f"charge={r.formal_charge}"
-        p.title = f"charge={p.formal_charge}"
-        with StructureWriter(f"{name}.xyz") as writer:
-            writer.extend([r, p])
+    except Exception:
+        logger.exception("problem with reaction %d: %s", idx, smirks)
+        return None
+    # Stick the reaction index and total charge in the title
+    r.title = f"rxn_{idx}_reactant charge={r.formal_charge}"
+    p.title = f"rxn_{idx}_product charge={p.formal_charge}"
+    return idx, r, p
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Convert reaction SMIRKS to 3D fully mapped complexes"
+    )
+    parser.add_argument(
+        "--smirks_csv",
+        default="rmechdb.csv",
+        help="CSV file whose first column holds reaction SMIRKS",
+    )
+    parser.add_argument("--output_path", default=".")
+    parser.add_argument(
+        "--batch_idx", type=int, default=0, help="Batch of the CSV to process"
+    )
+    parser.add_argument(
+        "--n_batch", type=int, default=1, help="Number of batches the CSV is split into"
+    )
+    parser.add_argument("--n_workers", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--task_timeout",
+        type=float,
+        default=300,
+        help="Seconds to wait for any single reaction before skipping it",
+    )
+    return parser.parse_args()
+
+
+def main():
+    from schrodinger.structure import StructureWriter
+
+    args = parse_args()
+    output_name = os.path.join(args.output_path, f"complexes_{args.batch_idx}.maegz")
+    # The final name only ever holds a complete batch (see the rename
+    # below), so on resumed runs its presence is enough to skip the batch
+    # before paying for any CSV parsing or reaction canonicalization
+    if os.path.exists(output_name):
+        return
+    # Write under a partial name so a crashed or killed batch is re-run
+    # rather than mistaken for a finished one; keep the maegz suffix so
+    # StructureWriter picks the right format
+    partial_name = os.path.join(
+        args.output_path, f"complexes_{args.batch_idx}_partial.maegz"
+    )
+    # Count rows with a raw line scan, then CSV-parse only this batch's slice
+    with open(args.smirks_csv) as fh:
+        total_rows = sum(1 for _ in fh)
+    batch_size = math.ceil(total_rows / args.n_batch)
+    start = args.batch_idx * batch_size
+    with open(args.smirks_csv) as fh:
+        next(islice(fh, start, start), None)
+        smirks_list = [row[0] for row in islice(csv.reader(fh), batch_size)]
+
+    # Drop duplicate rows before paying for any 3D work. The canonical
+    # reaction SMILES keeps atom-map numbers and component order, so this
+    # only collapses rows that are exact duplicates up to per-molecule
+    # atom ordering; rows with different mappings stay distinct, which is
+    # right — they describe different mechanisms. Unparseable SMIRKS pass
+    # through for per-task reporting
+    seen = set()
+    tasks = []
+    for idx, smirks in enumerate(smirks_list, start=start):
+        try:
+            key = AllChem.ReactionToSmiles(parse_smirks(smirks), canonical=True)
+        except Exception:
+            key = smirks
+        if key not in seen:
+            seen.add(key)
+            tasks.append((idx, smirks))
+    if not tasks:
+        return
+
+    # Reactions are independent, so farm them out to a pool of workers; one
+    # writer for the whole batch keeps the output a single concatenated
+    # maegz and avoids paying a file open/close per reaction. mp.Pool
+    # rather than ProcessPoolExecutor because the latter cannot kill a
+    # running task (cancel() is a no-op once a worker has started, and its
+    # context exit joins every worker), whereas the Pool context exit calls
+    # terminate(), so a wedged build_complexes dies with the pool instead
+    # of stalling the batch
+    nproc = min(args.n_workers, len(tasks))
+    with mp.get_context("fork").Pool(nproc) as pool, StructureWriter(
+        partial_name
+    ) as writer:
+        async_results = [
+            (task[0], pool.apply_async(process_one, (task,))) for task in tasks
+        ]
+        for idx, async_result in async_results:
+            try:
+                result = async_result.get(timeout=args.task_timeout)
+            except mp.TimeoutError:
+                logger.warning("timeout on reaction %d", idx)
+                continue
+            if result is not None:
+                writer.extend(result[1:])
+    os.replace(partial_name, output_name)
+
+
+if __name__ == "__main__":
+    main()